@@ -0,0 +1,37 @@
+import sys
+import json
+import argparse
+
+
+def load_stages(path):
+    with open(path) as f:
+        report = json.load(f)
+    return {(result["property_type"], result["rows"], stage): timing["min"]
+            for result in report["results"]
+            for stage, timing in result["stages"].items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two benchmark reports written by benchmarks.run")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="ratio of current to baseline time reported as a regression")
+    args = parser.parse_args()
+
+    baseline, current = load_stages(args.baseline), load_stages(args.current)
+
+    regressions = 0
+    for key in sorted(baseline.keys() & current.keys()):
+        ratio = current[key] / baseline[key] if baseline[key] else float("inf")
+        flag = "REGRESSION" if ratio > args.threshold else ""
+        regressions += bool(flag)
+        print(f"{key[0]:<11}{key[1]:>10}  {key[2]:<26}"
+              f"{baseline[key]:>10.4f}s{current[key]:>10.4f}s{ratio:>8.2f}x  {flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+
+# What the landing page imports, what a page imports before its first chart,
+# and the plotting libraries imported with the first chart or map
+default_modules = ["functions.main_page", "functions.startup",
+                   "functions.dataset_cache", "functions.houses",
+                   "functions.plotting", "functions.maps"]
+
+
+def import_times(module):
+    # Self time in seconds of every module imported by a fresh interpreter
+    # importing module, from python -X importtime
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             f"import {module}"], capture_output=True, text=True)
+    if result.returncode:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us) / 1e6
+    return times
+
+
+def breakdown(times, top):
+    # Self times summed per top-level package
+    packages = defaultdict(float)
+    for name, seconds in times.items():
+        packages[name.split(".")[0]] += seconds
+    return dict(sorted(packages.items(), key=lambda item: -item[1])[:top])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import time of the dashboard modules per top-level package")
+    parser.add_argument("modules", nargs="*", default=default_modules)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="also write the breakdown as JSON")
+    args = parser.parse_args()
+
+    # Modules the interpreter imports at startup are left out
+    startup = set(import_times("sys"))
+
+    report = {}
+    for module in args.modules:
+        try:
+            times = import_times(module)
+        except ImportError as e:
+            print(f"{module}: {e}", file=sys.stderr)
+            continue
+
+        times = {name: t for name, t in times.items() if name not in startup}
+        report[module] = {"total": sum(times.values()),
+                          "packages": breakdown(times, args.top)}
+
+        print(f"{module}: {report[module]['total']:.3f}s")
+        for package, seconds in report[module]["packages"].items():
+            print(f"    {package:<24}{seconds:>8.3f}s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
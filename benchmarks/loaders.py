@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.engine import make_url
+
+from benchmarks.run import timed, git_revision
+from benchmarks.synthetic import generate
+
+
+# (loader, rows per chunk) compared by the benchmark
+configurations = {"read_sql": ("sql", 0), "read_sql_chunked": ("sql", 100_000),
+                  "copy": ("copy", 100_000)}
+
+default_sizes = [10_000, 100_000, 1_000_000]
+
+sql_types = {"int64": "bigint", "object": "text", "float64": "double precision",
+             "datetime64[ns]": "timestamp"}
+
+
+def use_database(url):
+    # The loader reads its credentials from the environment when it first
+    # connects
+    url = make_url(url)
+    os.environ.update({"POSTGRESQL_USER": url.username or "",
+                       "POSTGRESQL_PASSWORD": url.password or "",
+                       "POSTGRESQL_HOST": url.host or "localhost",
+                       "POSTGRESQL_PORT": str(url.port or 5432),
+                       "POSTGRESQL_DBNAME": url.database})
+
+
+def create_table(engine, property_type, df):
+    table = f"otodom_{property_type}"
+    columns = ", ".join(f"{col} {sql_types[str(dtype)]}"
+                        for col, dtype in df.dtypes.items())
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor, tempfile.TemporaryFile("w+") as f:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"CREATE TABLE {table} ({columns})")
+            df.to_csv(f, index=False, header=False)
+            f.seek(0)
+            cursor.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv)", f)
+            cursor.execute(f"CREATE INDEX ON {table} (utc_created_at)")
+            cursor.execute(f"ANALYZE {table}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def benchmark(data_loading, property_type, n_rows, repeats):
+    create_table(data_loading.get_engine(), property_type,
+                 generate(property_type, n_rows))
+
+    stages = {}
+    reference = None
+    for name, (loader, chunk_rows) in configurations.items():
+        data_loading.LOADER, data_loading.CHUNK_ROWS = loader, chunk_rows
+        (_, df), times = timed(
+            lambda: data_loading.fetch_and_preprocess(property_type), repeats)
+        stages[name] = {"min": min(times), "median": float(np.median(times)),
+                        "all": times}
+
+        # Every loader has to produce the frame of the original read_sql path
+        if reference is None:
+            reference = df
+        else:
+            pd.testing.assert_frame_equal(df, reference)
+
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the read_sql and COPY loaders on synthetic otodom "
+                    "tables. The otodom_* tables of the database given in "
+                    "BENCHMARK_DATABASE_URL are replaced, use a scratch database.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes)
+    parser.add_argument("--property-types", nargs="+",
+                        default=["lands", "houses", "apartments"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="benchmarks/results_loaders.json")
+    args = parser.parse_args()
+
+    if "BENCHMARK_DATABASE_URL" not in os.environ:
+        parser.error("BENCHMARK_DATABASE_URL is not set")
+    use_database(os.environ["BENCHMARK_DATABASE_URL"])
+
+    from functions import data_loading
+
+    report = {"meta": {"git_revision": git_revision(),
+                       "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+                       "pandas": pd.__version__, "repeats": args.repeats},
+              "results": []}
+
+    for property_type in args.property_types:
+        for n_rows in args.sizes:
+            print(f"{property_type}: {n_rows} rows", file=sys.stderr)
+            report["results"].append({
+                "property_type": property_type, "rows": n_rows,
+                "stages": benchmark(data_loading, property_type, n_rows,
+                                    args.repeats)})
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from benchmarks.synthetic import generate
+from functions import lands, houses, apartments
+from functions.data_loading import preprocess_funcs_dict, share_frame, attach_frame
+from functions.filters import frame_bounds, apply_filters, build_column_stats
+from functions.bitmap_index import build_bitmap_index
+from functions.cube import (build_cube, cube_answerable, filter_cells,
+                            month_stats, province_means, area_columns)
+from functions.sketches import (build_sketches, filter_sketches, month_quantiles,
+                                province_quantiles)
+
+
+# Same setting as the dashboard process, see functions/dataset_cache.py
+pd.set_option("mode.copy_on_write", True)
+
+modules = {"lands": lands, "houses": houses, "apartments": apartments}
+
+default_sizes = [10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def timed(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def page_filters(property_type, df, tight=False):
+    # The default view of the page (last 90 days, every widget at its full
+    # range) or a narrow preset: one province, secondary market, price cap
+    bounds = frame_bounds(property_type, df)
+    filters = {"utc_created_at": (date.today() - timedelta(days=90), date.today())}
+    for col, value in bounds.items():
+        filters[col] = value if isinstance(value, tuple) else list(value)
+    filters["province"] = ["mazowieckie"] if tight else None
+
+    if tight:
+        filters["price"] = (bounds["price"][0], float(df["price"].median()))
+        if "market" in filters:
+            filters["market"] = [v for v in bounds["market"] if v != "Primary"]
+    return filters, bounds
+
+
+def benchmark(property_type, n_rows, repeats, map_max_rows):
+    module = modules[property_type]
+    stages = {}
+    sizes = {}
+
+    def record(stage, func):
+        result, times = timed(func, repeats)
+        stages[stage] = {"min": min(times), "median": float(np.median(times)),
+                         "all": times}
+        return result
+
+    raw = generate(property_type, n_rows)
+    df = record("preprocess", lambda: preprocess_funcs_dict[property_type](raw))
+    del raw
+
+    # What a pool worker hands back in load_data_concurrently; the frame has
+    # to come back unchanged
+    shared = record("share_and_attach_frame", lambda: attach_frame(share_frame(df)))
+    pd.testing.assert_frame_equal(shared, df)
+    del shared
+
+    index = record("build_bitmap_index", lambda: build_bitmap_index(property_type, df))
+    stats = record("build_column_stats", lambda: build_column_stats(property_type, df))
+    cube = record("build_cube", lambda: build_cube(property_type, df))
+    sketches = record("build_sketches", lambda: build_sketches(property_type, df))
+
+    for preset in ["default", "tight"]:
+        filters, bounds = page_filters(property_type, df, tight=preset == "tight")
+        record(f"filter_{preset}_scan", lambda: apply_filters(df, filters))
+        filtered = record(f"filter_{preset}_indexed",
+                          lambda: apply_filters(df, filters, index=index, stats=stats))
+        sizes[f"filter_{preset}_rows"] = len(filtered)
+
+    # A start date after the end date, with a narrowed multiselect, has to
+    # select nothing on both paths
+    filters, _ = page_filters(property_type, df, tight=True)
+    filters["utc_created_at"] = filters["utc_created_at"][::-1]
+    assert not len(apply_filters(df, filters))
+    assert not len(apply_filters(df, filters, index=index, stats=stats))
+
+    filters, bounds = page_filters(property_type, df)
+    filtered = apply_filters(df, filters, index=index, stats=stats)
+    if not len(filtered):
+        return stages, sizes
+
+    fig_all = record("plot_all", lambda: module.plot_all(filtered))
+    record("plot_all_unbinned", lambda: module.plot_all(filtered, binned=False))
+    fig_month = record("plot_by_month", lambda: module.plot_by_month(filtered))
+    fig_province = record("plot_by_province",
+                          lambda: module.plot_by_province(filtered))
+
+    if cube_answerable(filters, bounds):
+        cells = filter_cells(cube, filters)
+        sketch_cells = filter_sketches(sketches, filters)
+        record("plot_by_month_cube", lambda: module.plot_by_month(
+            filtered, month_stats(cells), month_quantiles(sketch_cells)))
+        record("plot_by_province_cube", lambda: module.plot_by_province(
+            filtered, province_means(cells, area_columns[property_type]),
+            province_quantiles(sketch_cells)))
+
+    for name, fig in [("plot_all", fig_all), ("plot_by_month", fig_month),
+                      ("plot_by_province", fig_province)]:
+        payload = record(f"serialize_{name}", fig.to_json)
+        sizes[f"serialize_{name}_bytes"] = len(payload)
+
+    if len(filtered) <= map_max_rows:
+        # The URLs the page fetches with dataset_cache.with_urls
+        filtered = filtered.assign(
+            url="https://www.otodom.pl/pl/oferta/" + filtered["id"].astype(str))
+        fig_map = record("plot_map", lambda: module.plot_map(filtered))
+        html = record("serialize_plot_map", fig_map._repr_html_)
+        sizes["serialize_plot_map_bytes"] = len(html)
+
+    return stages, sizes
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time preprocessing, filtering and plotting on synthetic otodom data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes)
+    parser.add_argument("--property-types", nargs="+", default=list(modules),
+                        choices=list(modules))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--map-max-rows", type=int, default=200_000,
+                        help="skip plot_map when the filtered frame is larger")
+    parser.add_argument("--output", default="benchmarks/results.json")
+    args = parser.parse_args()
+
+    report = {"meta": {"git_revision": git_revision(),
+                       "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+                       "python": platform.python_version(),
+                       "pandas": pd.__version__, "numpy": np.__version__,
+                       "plotly": plotly.__version__, "repeats": args.repeats},
+              "results": []}
+
+    for property_type in args.property_types:
+        for n_rows in args.sizes:
+            print(f"{property_type}: {n_rows} rows", file=sys.stderr)
+            stages, sizes = benchmark(property_type, n_rows, args.repeats,
+                                      args.map_max_rows)
+            report["results"].append({"property_type": property_type,
+                                      "rows": n_rows, "stages": stages,
+                                      "sizes": sizes})
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import sys
+import argparse
+
+import numpy as np
+
+from benchmarks.run import page_filters
+from benchmarks.synthetic import generate
+from functions.data_loading import preprocess_funcs_dict
+from functions.filters import apply_filters
+from functions.sketches import (RELATIVE_ACCURACY, build_sketches, filter_sketches,
+                                month_quantiles, province_quantiles,
+                                exact_month_quantiles, exact_province_quantiles)
+
+
+def max_errors(estimated, exact):
+    # Largest relative error per measure, and whether every quantile is within
+    # the documented bound (up to floating point error)
+    errors, within = {}, True
+    for measure, values in exact.items():
+        estimate = estimated[measure].reindex_like(values).to_numpy(dtype=float)
+        values = values.to_numpy(dtype=float)
+        difference = np.abs(estimate - values)
+        errors[measure] = float(np.nanmax(difference / values))
+        within &= bool((difference <= RELATIVE_ACCURACY * values * (1 + 1e-9)).all())
+    return errors, within
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the quantiles read from the sketches with exact "
+                    "quantiles on synthetic otodom data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--property-types", nargs="+",
+                        default=["lands", "houses", "apartments"])
+    args = parser.parse_args()
+
+    failed = False
+    for property_type in args.property_types:
+        for n_rows in args.sizes:
+            df = preprocess_funcs_dict[property_type](generate(property_type, n_rows))
+            sketches = build_sketches(property_type, df)
+
+            for preset, province in [("default", None), ("province", ["mazowieckie"])]:
+                filters, _ = page_filters(property_type, df)
+                filters["province"] = province
+                filtered = apply_filters(df, filters)
+                cells = filter_sketches(sketches, filters)
+
+                for by, estimated, exact in [
+                        ("month", month_quantiles(cells), exact_month_quantiles(filtered)),
+                        ("province", province_quantiles(cells),
+                         exact_province_quantiles(filtered))]:
+                    errors, within = max_errors(estimated, exact)
+                    failed |= not within
+                    print(f"{property_type:<11}{n_rows:>9} {preset:<9}{by:<9}"
+                          + "".join(f"{measure} {error:.4%}  "
+                                    for measure, error in errors.items())
+                          + ("" if within else "OUT OF BOUNDS"))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+
+# Voivodeship: (latitude, longitude, share of offers)
+provinces = {
+    "mazowieckie": (52.3, 21.0, 0.17), "slaskie": (50.3, 19.0, 0.10),
+    "malopolskie": (49.9, 20.2, 0.10), "dolnoslaskie": (51.1, 16.5, 0.10),
+    "wielkopolskie": (52.3, 17.0, 0.09), "pomorskie": (54.2, 18.0, 0.08),
+    "lodzkie": (51.6, 19.4, 0.06), "kujawsko-pomorskie": (53.0, 18.5, 0.05),
+    "zachodniopomorskie": (53.5, 15.3, 0.05), "lubelskie": (51.2, 22.9, 0.04),
+    "podkarpackie": (49.9, 22.2, 0.04), "warminsko-mazurskie": (53.8, 20.8, 0.03),
+    "podlaskie": (53.2, 22.9, 0.03), "swietokrzyskie": (50.8, 20.7, 0.02),
+    "opolskie": (50.6, 17.9, 0.02), "lubuskie": (52.2, 15.3, 0.02)}
+
+# Raw values as stored by the scraper, None for missing
+locations = {"city": 0.45, "suburban": 0.30, "country": 0.20, None: 0.05}
+markets = {"SECONDARY": 0.7, "PRIMARY": 0.3}
+statuses = {"ready_to_use": 0.5, "to_completion": 0.25, "to_renovation": 0.1,
+            None: 0.15}
+
+
+def _choice(rng, distribution, n):
+    values = np.array(list(distribution), dtype=object)
+    return values[rng.choice(len(values), size=n, p=list(distribution.values()))]
+
+
+def _lognormal(rng, median, sigma, n):
+    return rng.lognormal(np.log(median), sigma, n)
+
+
+def _common_columns(rng, n, history_days):
+    names = list(provinces)
+    centers = np.array([provinces[name][:2] for name in names])
+    weights = np.array([provinces[name][2] for name in names])
+    province_idx = rng.choice(len(names), size=n, p=weights / weights.sum())
+
+    # Offers become denser towards the present, like a growing scraper history
+    now = pd.Timestamp.now().floor("s")
+    age = (1 - rng.power(2, n)) * history_days * 86400
+    created = now.to_datetime64() - (age * 1e9).astype("timedelta64[ns]")
+
+    return pd.DataFrame({
+        "id": np.arange(n),
+        "url": "https://www.otodom.pl/pl/oferta/" + pd.Series(np.arange(n)).astype(str),
+        "title": "Synthetic offer",
+        "advertiser_type": _choice(rng, {"agency": 0.8, "private": 0.2}, n),
+        "advert_type": _choice(rng, {"AGENCY": 0.8, "PRIVATE": 0.2}, n),
+        "utc_created_at": created,
+        "province": np.array(names, dtype=object)[province_idx],
+        "latitude": centers[province_idx, 0] + rng.normal(0, 0.35, n),
+        "longitude": centers[province_idx, 1] + rng.normal(0, 0.5, n)})
+
+
+def _build_years(rng, n):
+    years = np.round(rng.triangular(1900, 2010, pd.Timestamp.now().year, n))
+    years[rng.random(n) < 0.05] = np.nan
+    return years
+
+
+def generate(property_type, n, seed=0, history_days=3 * 365):
+    # Raw frame with the columns and dtypes read by fetch_and_preprocess
+    rng = np.random.default_rng(seed)
+    df = _common_columns(rng, n, history_days)
+
+    if property_type == "lands":
+        df["location"] = _choice(rng, locations, n)
+        df["land_area"] = np.round(_lognormal(rng, 1200, 0.6, n))
+        df["price"] = np.round(df["land_area"] * _lognormal(rng, 80, 0.7, n), -2)
+    elif property_type == "houses":
+        df["location"] = _choice(rng, locations, n)
+        df["market"] = _choice(rng, markets, n)
+        df["lot_area"] = np.round(_lognormal(rng, 900, 0.5, n))
+        df["house_area"] = np.round(_lognormal(rng, 140, 0.3, n), 1)
+        df["build_year"] = _build_years(rng, n)
+        df["price"] = np.round(df["house_area"] * _lognormal(rng, 5000, 0.35, n), -3)
+    elif property_type == "apartments":
+        df["location"] = _choice(rng, locations, n)
+        df["market"] = _choice(rng, markets, n)
+        df["build_year"] = _build_years(rng, n)
+        df["apartment_area"] = np.round(_lognormal(rng, 55, 0.35, n), 1)
+        df["status"] = _choice(rng, statuses, n)
+        df["price"] = np.round(df["apartment_area"] * _lognormal(rng, 9000, 0.35, n), -3)
+    else:
+        raise ValueError(f"Unknown property type: {property_type}")
+
+    return df
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+
+def build_bitmap_index(property_type, df):
+    # One packed bitset per value of every categorical column, bit i set when
+    # row i of the frame holds the value; missing values are kept under None
+    index = {}
+    for col, dtype in df.dtypes.items():
+        if not isinstance(dtype, pd.CategoricalDtype):
+            continue
+
+        codes = df[col].cat.codes.to_numpy()
+        bitsets = {value: np.packbits(codes == code)
+                   for code, value in enumerate(dtype.categories)}
+        if (codes == -1).any():
+            bitsets[None] = np.packbits(codes == -1)
+        index[col] = bitsets
+
+    return index
+
+
+def bitmap_mask(index, filters, start, stop):
+    # Evaluates the multiselect filters over rows [start, stop) by OR-ing the
+    # bitsets of selected values and AND-ing the columns; returns None when
+    # none of the filters restricts anything
+    stop = max(start, stop)
+    first_byte, last_byte = start // 8, -(-stop // 8)
+    packed = None
+
+    for col, value in filters.items():
+        if col not in index or value is None or isinstance(value, tuple):
+            continue
+
+        selected = {None if pd.isna(v) else v for v in value}
+        if selected.issuperset(index[col]):
+            continue
+
+        column_bits = np.zeros(last_byte - first_byte, dtype=np.uint8)
+        for v in selected:
+            if v in index[col]:
+                column_bits |= index[col][v][first_byte:last_byte]
+
+        packed = column_bits if packed is None else packed & column_bits
+
+    if packed is None:
+        return None
+
+    offset = start - first_byte * 8
+    return np.unpackbits(packed, count=offset + stop - start)[offset:].astype(bool)
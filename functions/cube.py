@@ -0,0 +1,95 @@
+import pandas as pd
+
+from functions.filters import day_bounds, range_columns
+
+
+category_columns = {"lands": "location", "houses": "location",
+                    "apartments": "status"}
+
+area_columns = {"lands": "land_area", "houses": "house_area",
+                "apartments": "apartment_area"}
+
+# The date filter has day precision, so cells are kept per day and rolled up
+# to months when a chart needs them
+cube_dimensions = {"lands": ["day", "province", "location"],
+                   "houses": ["day", "province", "location", "market"],
+                   "apartments": ["day", "province", "status", "market"]}
+
+measures = ["price", "price_per_m2", "area"]
+
+
+def complete_rows(property_type, df):
+    # Range predicates drop rows with a missing value even at their full
+    # bounds, so only rows with every range column set are aggregated
+    return df[df[range_columns[property_type]].notna().all(axis=1)]
+
+
+def build_cube(property_type, df):
+    # Sums are accumulated in float64, the frames keep measures as float32
+    df = complete_rows(property_type, df)
+    data = df.assign(day=df["utc_created_at"].dt.floor("D"),
+                     price=df["price"].astype("float64"),
+                     price_per_m2=df["price_per_m2"].astype("float64"),
+                     area=df[area_columns[property_type]].astype("float64"))
+
+    aggregations = {"count": ("price", "size")}
+    for measure in measures:
+        aggregations[f"{measure}_sum"] = (measure, "sum")
+        aggregations[f"{measure}_n"] = (measure, "count")
+
+    cube = data.groupby(cube_dimensions[property_type], observed=True,
+                        dropna=False).agg(**aggregations)
+    return cube.reset_index()
+
+
+def cube_answerable(filters, bounds):
+    # Numeric range filters are not dimensions of the cube, so the cube can
+    # only be used when every one of them is set to the full range: then it
+    # excludes exactly the rows left out of the cube by complete_rows
+    for col, bound in bounds.items():
+        if not isinstance(bound, tuple):
+            continue
+        value = filters.get(col)
+        if value is None or value[0] > bound[0] or value[1] < bound[1]:
+            return False
+    return True
+
+
+def filter_cells(cube, filters):
+    mask = pd.Series(True, index=cube.index)
+    for col, value in filters.items():
+        if value is None:
+            continue
+
+        if col == "utc_created_at":
+            start, end = day_bounds(cube["day"], *value)
+            mask &= (cube["day"] >= start) & (cube["day"] < end)
+        elif not isinstance(value, tuple):
+            mask &= cube[col].isin(value)
+
+    return cube[mask]
+
+
+def month_stats(cells):
+    cells = cells[cells["count"] > 0]
+    grouped = cells.groupby(cells["day"].dt.to_period("M"))
+    sums = grouped[["count", "price_sum", "price_n", "price_per_m2_sum",
+                    "price_per_m2_n"]].sum()
+
+    unique_months = grouped["day"].min().dt.date.values
+    n_offers = sums["count"].tolist()
+    price_data = (sums["price_sum"] / sums["price_n"]).round().tolist()
+    price_per_m2_data = (sums["price_per_m2_sum"]
+                         / sums["price_per_m2_n"]).round().tolist()
+
+    return unique_months, n_offers, price_data, price_per_m2_data
+
+
+def province_means(cells, area_column):
+    sums = cells.groupby("province", observed=True).sum(numeric_only=True)
+
+    return pd.DataFrame({
+        area_column: sums["area_sum"] / sums["area_n"],
+        "price": sums["price_sum"] / sums["price_n"],
+        "price_per_m2": sums["price_per_m2_sum"] / sums["price_per_m2_n"],
+    }).round()
@@ -1,13 +1,43 @@
 import os
+import mmap
+import asyncio
+import tempfile
+import numpy as np
 import pandas as pd
-import streamlit as st
+import pyarrow as pa
+import pyarrow.csv
+import threading as _threading
 import multiprocessing
 import concurrent.futures
 from dotenv import load_dotenv
+from sqlalchemy import create_engine
 
 from functions.lands import preprocess_lots
 from functions.houses import preprocess_houses
 from functions.apartments import preprocess_apartments
+from functions.schema import memory_report, concat_compact
+from functions.timing import span, gauge_sources
+from functions.filters import (build_where_clause, build_bounds_query,
+                               bounds_from_row, category_columns)
+
+
+load_dotenv()
+
+PROPERTY_TYPES = ("lands", "houses", "apartments")
+
+# Rows fetched and preprocessed at a time; 0 reads whole tables at once
+CHUNK_ROWS = int(os.environ.get("DATASET_CHUNK_ROWS", 100_000))
+
+# "sql" reads rows through the driver, "copy" bulk-exports them as CSV
+LOADER = os.environ.get("DATASET_LOADER", "sql")
+
+POOL_SIZE = int(os.environ.get("POSTGRESQL_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.environ.get("POSTGRESQL_MAX_OVERFLOW", 5))
+STATEMENT_TIMEOUT = float(os.environ.get("POSTGRESQL_STATEMENT_TIMEOUT", 300))
+
+_engine_lock = _threading.Lock()
+_engine = None
+_engine_pid = None
 
 
 def generate_psql_connection_string(user, password, host, port, dbname):
@@ -15,7 +45,6 @@ def generate_psql_connection_string(user, password, host, port, dbname):
 
 
 def get_credentials():
-    load_dotenv()
     user = os.environ["POSTGRESQL_USER"]
     password = os.environ["POSTGRESQL_PASSWORD"]
     host = os.environ["POSTGRESQL_HOST"]
@@ -25,56 +54,390 @@ def get_credentials():
     return user, password, host, port, dbname
 
 
-def read_from_db(sql, conn_str):
-    df = pd.read_sql(sql, conn_str)
+def get_engine():
+    # One pool per process, shared by the loader threads, background refreshes
+    # and query mode; pool workers started by fork build their own, as
+    # pooled connections must not be shared across processes
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            if _engine is not None:
+                # Inherited from the parent: forget its connections without
+                # closing them under the parent
+                _engine.dispose(close=False)
+
+            connect_args = {}
+            if STATEMENT_TIMEOUT:
+                connect_args["options"] = (
+                    f"-c statement_timeout={int(STATEMENT_TIMEOUT * 1000)}")
+
+            _engine = create_engine(
+                generate_psql_connection_string(*get_credentials()),
+                pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                pool_pre_ping=True, connect_args=connect_args)
+            _engine_pid = os.getpid()
+        return _engine
+
+
+def pool_stats():
+    with _engine_lock:
+        if _engine is None:
+            return None
+        pool = _engine.pool
+    return {"size": pool.size(), "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(), "overflow": pool.overflow(),
+            "max_overflow": MAX_OVERFLOW}
+
+
+gauge_sources["postgresql_pool"] = pool_stats
+
+
+def read_from_db(sql, params=None):
+    with span("read_from_db"):
+        df = pd.read_sql(sql, get_engine(), params=params)
     return df
 
 
+preprocess_funcs_dict = {"lands": preprocess_lots, "houses": preprocess_houses,
+                         "apartments": preprocess_apartments}
+
+# Only the columns used by the filters and charts; offer URLs are fetched
+# by id when a map shows them, see fetch_urls
+sql_queries_dict = {"lands": """SELECT id, price, utc_created_at, province, location,
+                                latitude, longitude, land_area
+                                FROM otodom_lands""",
+
+                    "houses": """SELECT id, price, utc_created_at, province, location,
+                                 latitude, longitude, market, lot_area, house_area,
+                                 build_year
+                                 FROM otodom_houses""",
+
+                    "apartments": """SELECT id, price, utc_created_at, province, market,
+                                     latitude, longitude, build_year,
+                                     apartment_area, status
+                                     FROM otodom_apartments"""}
+
+# Types of the columns exported by COPY; the rest are parsed as float64, as
+# read_sql returns them. Timestamps are parsed by pandas to keep the dtype
+# read_sql gives for both timestamp and timestamptz columns.
+copy_column_types = {col: pa.string() for col in [
+    "utc_created_at", "province", "location", "market", "status"]}
+copy_column_types["id"] = pa.int64()
+
+
+def stream_from_db(sql, params=None, chunk_rows=CHUNK_ROWS):
+    # Server-side cursor, so neither the driver nor pandas hold more than
+    # chunk_rows raw rows at a time
+    with get_engine().connect().execution_options(
+            stream_results=True, max_row_buffer=chunk_rows) as conn:
+        chunks = iter(pd.read_sql(sql, conn, params=params, chunksize=chunk_rows))
+        while True:
+            with span("read_from_db"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+
+def _copy_chunk(batches, schema):
+    df = pa.Table.from_batches(batches, schema=schema).to_pandas()
+    df["utc_created_at"] = pd.to_datetime(df["utc_created_at"], format="ISO8601")
+    return df
+
+
+def copy_from_db(sql, params=None, chunk_rows=CHUNK_ROWS):
+    # COPY skips the per-row conversion to Python objects in the driver; the
+    # CSV is spooled to a temporary file and parsed by Arrow in chunks, so
+    # memory stays bounded like in stream_from_db
+    conn = get_engine().raw_connection()
+    try:
+        with tempfile.TemporaryFile() as f:
+            with span("read_from_db"), conn.cursor() as cursor:
+                if params:
+                    sql = cursor.mogrify(sql, params).decode()
+                cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+                cursor.copy_expert(
+                    f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            conn.rollback()
+
+            f.seek(0)
+            header = f.readline().decode().strip().split(",")
+            f.seek(0)
+
+            # Unquoted empty fields are NULLs, quoted ones empty strings
+            reader = pa.csv.open_csv(f, convert_options=pa.csv.ConvertOptions(
+                column_types={col: copy_column_types.get(col, pa.float64())
+                              for col in header},
+                strings_can_be_null=True, quoted_strings_can_be_null=False))
+
+            batches, n_rows, chunked = [], 0, False
+            for batch in reader:
+                batches.append(batch)
+                n_rows += batch.num_rows
+                if chunk_rows and n_rows >= chunk_rows:
+                    yield _copy_chunk(batches, reader.schema)
+                    batches, n_rows, chunked = [], 0, True
+
+            if batches or not chunked:
+                yield _copy_chunk(batches, reader.schema)
+    finally:
+        conn.close()
+
+
+def read_and_preprocess(property_type, sql, params=None, prefilter=None):
+    # Every chunk is reduced to the compact schema before the next one is
+    # read; ordering by the sort key of the frames keeps the concatenated
+    # chunks in time order
+    preprocess_func = preprocess_funcs_dict[property_type]
+    prefilter = prefilter or (lambda df: df)
+
+    if LOADER != "copy" and not CHUNK_ROWS:
+        df = prefilter(read_from_db(sql, params))
+        with span(f"preprocess:{property_type}"):
+            return preprocess_func(df)
+
+    frames = []
+    chunks = (copy_from_db if LOADER == "copy" else stream_from_db)(
+        sql + "\nORDER BY utc_created_at", params, chunk_rows=CHUNK_ROWS)
+    for chunk in chunks:
+        with span(f"preprocess:{property_type}"):
+            frames.append(preprocess_func(prefilter(chunk)))
+
+    return concat_compact(frames)
+
+
 def fetch_and_preprocess(property_type):
 
     pd.options.mode.chained_assignment = None
 
-    preprocess_funcs_dict = {"lands": preprocess_lots, "houses": preprocess_houses,
-                             "apartments": preprocess_apartments}
+    sql_query = sql_queries_dict[property_type]
+
+    return property_type, read_and_preprocess(property_type, sql_query)
+
+
+def compute_watermark(df):
+    if not len(df):
+        return None
+
+    latest = df["utc_created_at"].max()
+    seen_ids = frozenset(df.loc[df["utc_created_at"] == latest, "id"].tolist())
+    return latest, seen_ids
+
+
+def fetch_new_and_preprocess(property_type, watermark):
+    # Offers sharing the watermark timestamp are fetched again and deduplicated
+    # by id, so rows inserted in the same second as the last sync are neither
+    # lost nor doubled.
+    if watermark is None:
+        return fetch_and_preprocess(property_type)
+
+    pd.options.mode.chained_assignment = None
+
+    latest, seen_ids = watermark
+    sql_query = (sql_queries_dict[property_type]
+                 + "\nWHERE utc_created_at >= %(since)s")
+
+    def drop_seen(df):
+        return df[~((df["utc_created_at"] == latest) & df["id"].isin(seen_ids))]
+
+    return property_type, read_and_preprocess(
+        property_type, sql_query, params={"since": latest.to_pydatetime()}, prefilter=drop_seen)
+
+
+def fetch_filtered_and_preprocess(property_type, filters):
+    pd.options.mode.chained_assignment = None
+
+    where_clause, params = build_where_clause(property_type, filters)
+    sql_query = sql_queries_dict[property_type] + "\nWHERE " + where_clause
 
-    sql_queries_dict = {"lands": """SELECT url, title, price, advertiser_type, advert_type,
-                                    utc_created_at, province, location, latitude, longitude,
-                                    land_area
-                                    FROM otodom_lands""",
+    return read_and_preprocess(property_type, sql_query, params)
 
-                    "houses": """SELECT url, title, price, advertiser_type, advert_type,
-                                    utc_created_at, province, location, latitude, longitude,
-                                    market, lot_area, house_area, build_year
-                                    FROM otodom_houses""",
 
-                    "apartments": """SELECT url, title, price, advertiser_type, advert_type,
-                                    utc_created_at, province, location, market, latitude, longitude,
-                                    build_year, apartment_area, status
-                                    FROM otodom_apartments"""}
+def fetch_urls(property_type, ids, batch_size=50_000):
+    # Series of offer URLs indexed by id
+    ids = [int(i) for i in ids]
+    batches = [read_from_db(f"SELECT id, url FROM otodom_{property_type} "
+                            "WHERE id = ANY(%(ids)s)",
+                            params={"ids": ids[start:start + batch_size]})
+               for start in range(0, len(ids), batch_size)]
+    if not batches:
+        return pd.Series([], index=pd.Index([], dtype="int64"), dtype=object)
+    return pd.concat(batches, ignore_index=True).set_index("id")["url"]
 
-    connection_string = generate_psql_connection_string(*get_credentials())
+
+def fetch_filter_bounds(property_type):
+    table = f"otodom_{property_type}"
+
+    aggregates = read_from_db(build_bounds_query(property_type, table))
+    row = [aggregates.iloc[0, i] for i in range(aggregates.shape[1])]
+    categories = {
+        col: read_from_db(f"SELECT DISTINCT {col} FROM {table}")[col].tolist()
+        for col in category_columns[property_type]}
+
+    return bounds_from_row(property_type, row, categories)
+
+
+def compact_memory_report(property_type, raw_df):
+    # Bytes per column of the preprocessed frame without and with the
+    # compact schema of the property type
     preprocess_func = preprocess_funcs_dict[property_type]
-    sql_query = sql_queries_dict[property_type]
+    return memory_report(preprocess_func(raw_df, compact=False),
+                         preprocess_func(raw_df))
+
+
+def snapshot_path(property_type, snapshot_dir):
+    return os.path.join(snapshot_dir, f"{property_type}.arrow")
+
+
+def save_snapshot(property_type, df, snapshot_dir):
+    # Arrow IPC keeps the pandas metadata, so the dtypes produced by the
+    # preprocess functions survive the round trip without re-parsing
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = snapshot_path(property_type, snapshot_dir)
+    table = pa.Table.from_pandas(df, preserve_index=True)
+
+    with pa.OSFile(path + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
 
-    return (property_type,
-            preprocess_func(read_from_db(sql_query, connection_string)))
 
+def load_snapshot(property_type, snapshot_dir):
+    path = snapshot_path(property_type, snapshot_dir)
+    if not os.path.exists(path):
+        return None
 
-def load_data_concurrently(threading):
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+async def load_data_async(property_types=PROPERTY_TYPES):
+    # Yields (property_type, df) for each table as soon as it is ready,
+    # fastest first; a failed load yields its exception in place of the frame
+    # so the other tables are still delivered
+    async def load(prop):
+        try:
+            return await asyncio.to_thread(fetch_and_preprocess, prop)
+        except Exception as e:
+            return prop, e
+
+    for next_done in asyncio.as_completed([load(prop) for prop in property_types]):
+        yield await next_done
+
+
+# tmpfs, so the files written by pool workers never reach the disk
+SHARED_MEMORY_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def share_frame(df):
+    # Writes the columns of a frame to one file in shared memory and returns
+    # its layout, which is all that goes back through the pool's pipe;
+    # categoricals travel as codes, columns of other types are pickled
+    columns, arrays, size = [], [], 0
+    for col, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            values = df[col].cat.codes.to_numpy()
+        elif isinstance(dtype, pd.DatetimeTZDtype):
+            values = df[col].dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+        elif isinstance(dtype, np.dtype) and dtype != object:
+            values = df[col].to_numpy()
+        else:
+            columns.append({"name": col, "dtype": dtype, "values": df[col].array})
+            continue
+
+        # Datetimes cannot be exported as a buffer, they travel as int64 and
+        # are viewed back as datetime64 in attach_frame
+        offset = -(-size // 64) * 64
+        columns.append({"name": col, "dtype": dtype, "offset": offset,
+                        "array_dtype": values.dtype.str})
+        if values.dtype.kind in "mM":
+            values = values.view("i8")
+        arrays.append((offset, np.ascontiguousarray(values)))
+        size = offset + values.nbytes
+
+    fd, path = tempfile.mkstemp(prefix="otodom-", dir=SHARED_MEMORY_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for offset, values in arrays:
+                f.seek(offset)
+                f.write(values.data)
+            f.truncate(max(size, 1))
+    except BaseException:
+        os.unlink(path)
+        raise
+
+    return {"path": path, "length": len(df), "columns": columns}
+
+
+def attach_frame(shared):
+    # The columns are views of a private (copy-on-write) mapping of the file,
+    # which is unlinked right away; the memory is released with the last
+    # column referencing it
+    try:
+        with open(shared["path"], "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    finally:
+        os.unlink(shared["path"])
+
+    data = {}
+    for column in shared["columns"]:
+        dtype = column["dtype"]
+        if "values" in column:
+            data[column["name"]] = column["values"]
+            continue
+
+        array_dtype = np.dtype(column["array_dtype"])
+        if array_dtype.kind in "mM":
+            values = np.frombuffer(buffer, dtype="i8", count=shared["length"],
+                                   offset=column["offset"]).view(array_dtype)
+        else:
+            values = np.frombuffer(buffer, dtype=array_dtype,
+                                   count=shared["length"], offset=column["offset"])
+        if isinstance(dtype, pd.CategoricalDtype):
+            values = pd.Categorical.from_codes(values, dtype=dtype)
+        elif isinstance(dtype, pd.DatetimeTZDtype):
+            values = pd.Series(values).dt.tz_localize("UTC").dt.tz_convert(dtype.tz)
+        data[column["name"]] = values
+
+    # copy=False also keeps pandas from consolidating the columns into blocks
+    return pd.DataFrame(data, index=pd.RangeIndex(shared["length"]), copy=False)
+
+
+def fetch_to_shared_memory(property_type):
+    property_type, df = fetch_and_preprocess(property_type)
+    return property_type, share_frame(df)
+
+
+def load_data_concurrently(threading, property_types=PROPERTY_TYPES):
+    data = {}
     if threading:
         with concurrent.futures.ThreadPoolExecutor() as executor:
             futures = [executor.submit(fetch_and_preprocess, prop)
-                       for prop in ["lands", "houses", "apartments"]]
+                       for prop in property_types]
             concurrent.futures.wait(futures)
 
             for future in futures:
                 result = future.result()
-                st.session_state.data[result[0]] = result[1]
+                data[result[0]] = result[1]
     else:
+        # Workers hand back shared memory instead of pickled frames; results
+        # are collected one by one so a failed table does not leave the files
+        # of the others behind
         with multiprocessing.Pool() as pool:
-            results_raw = pool.starmap(
-                fetch_and_preprocess,
-                [(prop,) for prop in ["lands", "houses", "apartments"]])
+            results_raw = [pool.apply_async(fetch_to_shared_memory, (prop,))
+                           for prop in property_types]
 
+            errors = []
             for result in results_raw:
-                st.session_state.data[result[0]] = result[1]
+                try:
+                    prop, shared = result.get()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                data[prop] = attach_frame(shared)
+
+            if errors:
+                raise errors[0]
+
+    return data
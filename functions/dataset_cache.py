@@ -0,0 +1,426 @@
+import os
+import json
+import asyncio
+import time
+import logging
+import threading
+import pandas as pd
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+from functions.data_loading import (PROPERTY_TYPES, load_data_concurrently,
+                                    load_data_async, fetch_new_and_preprocess,
+                                    compute_watermark, save_snapshot, load_snapshot,
+                                    fetch_filtered_and_preprocess,
+                                    fetch_filter_bounds, fetch_urls)
+from functions.filters import frame_bounds, apply_filters, build_column_stats
+from functions.cube import build_cube, cube_answerable, filter_cells
+from functions.schema import concat_compact
+from functions.bitmap_index import build_bitmap_index
+from functions.sketches import build_sketches, filter_sketches
+from functions.result_cache import LRUCache, fingerprint
+from functions.timing import span, gauge_sources
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Sessions get shallow copies of the shared frames; with copy-on-write any
+# modification made by a page copies the touched column instead of mutating
+# the data every other session is looking at.
+pd.set_option("mode.copy_on_write", True)
+
+DATASET_TTL = float(os.environ.get("DATASET_CACHE_TTL", 3600))
+INCREMENTAL_SYNC = os.environ.get("DATASET_SYNC_MODE", "full") == "incremental"
+SNAPSHOT_DIR = os.environ.get("DATASET_SNAPSHOT_DIR", "")
+FILTER_CACHE_BYTES = int(float(os.environ.get("FILTER_CACHE_MB", 256)) * 2**20)
+FIGURE_CACHE_BYTES = int(float(os.environ.get("FIGURE_CACHE_MB", 128)) * 2**20)
+QUERY_MODE = os.environ.get("DATASET_QUERY_MODE", "0") == "1"
+REFRESH_INTERVAL = float(os.environ.get("DATASET_REFRESH_INTERVAL", 0))
+RETRY_INTERVAL = float(os.environ.get("DATASET_RETRY_INTERVAL", 60))
+
+_lock = threading.Lock()
+_entries = {}   # property_type -> {"df", "derived", "loaded_at", "version", "watermark"}
+_inflight = {}  # property_type -> Future of df
+_version = 0
+_bounds = {}    # property_type -> (bounds, loaded_at), used in query mode
+_urls = {}      # property_type -> Series of offer URLs by id, filled on demand
+_refreshes = {}  # property_type -> {"refreshed_at", "duration", "error"}
+_scheduler = None
+
+# Filtered frames shared by all sessions, keyed by dataset version and filters
+filtered_results = LRUCache(FILTER_CACHE_BYTES)
+
+# Serialized figures and map HTML built from those frames
+figures = LRUCache(FIGURE_CACHE_BYTES)
+
+# Structures derived from a dataset, rebuilt whenever the dataset is stored
+derived_builders = {"cube": build_cube, "bitmap_index": build_bitmap_index,
+                    "column_stats": build_column_stats, "sketches": build_sketches,
+                    "bounds": frame_bounds}
+
+
+def _is_fresh(entry, ttl):
+    # An entry whose reload failed counts as fresh until the next retry
+    now = time.monotonic()
+    return entry is not None and (now - entry["loaded_at"] < ttl
+                                  or now < entry.get("retry_at", 0))
+
+
+def _store(property_type, df, watermark, snapshot=True):
+    global _version
+    derived = {}
+    for name, builder in derived_builders.items():
+        with span(f"derived:{name}"):
+            derived[name] = builder(property_type, df)
+
+    with _lock:
+        _version += 1
+        _entries[property_type] = {"df": df, "derived": derived,
+                                   "loaded_at": time.monotonic(),
+                                   "version": _version, "watermark": watermark}
+    filtered_results.invalidate(property_type)
+    figures.invalidate(property_type)
+
+    if snapshot and SNAPSHOT_DIR:
+        try:
+            save_snapshot(property_type, df, SNAPSHOT_DIR)
+        except Exception:
+            logger.exception("Could not save %s snapshot", property_type)
+
+
+def _sync(property_type, entry):
+    new_rows = fetch_new_and_preprocess(property_type, entry["watermark"])[1]
+    if not len(new_rows):
+        with _lock:
+            entry["loaded_at"] = time.monotonic()
+        return entry["df"]
+
+    df = concat_compact([entry["df"], new_rows])
+    _store(property_type, df, compute_watermark(df))
+    return df
+
+
+def _refresh_in_background(property_type):
+    # The new frame and its derived structures are built while readers keep
+    # using the current entry, which _store then replaces in one step
+    with _lock:
+        entry = _entries.get(property_type)
+
+    started = time.monotonic()
+    error = None
+    try:
+        if INCREMENTAL_SYNC and entry is not None:
+            _sync(property_type, entry)
+        else:
+            df = load_data_concurrently(True, [property_type])[property_type]
+            _store(property_type, df, compute_watermark(df))
+    except Exception as e:
+        error = repr(e)
+        logger.exception("Background refresh of %s failed, serving the "
+                         "previous version", property_type)
+
+    with _lock:
+        _refreshes[property_type] = {"refreshed_at": time.time(),
+                                     "duration": time.monotonic() - started,
+                                     "error": error}
+
+
+def _run_scheduler(interval):
+    while True:
+        time.sleep(interval)
+        with _lock:
+            # Tables nobody asked for yet are loaded on demand, and tables
+            # being loaded already are left to that load
+            due = [prop for prop in _entries if prop not in _inflight]
+        for prop in due:
+            _refresh_in_background(prop)
+
+
+def start_refresh_scheduler(interval=REFRESH_INTERVAL):
+    # One thread per process; while it runs, sessions are served the current
+    # version instead of reloading expired tables themselves
+    global _scheduler
+    with _lock:
+        if _scheduler is not None or not interval:
+            return
+        _scheduler = threading.Thread(target=_run_scheduler, args=(interval,),
+                                      name="dataset-refresh", daemon=True)
+    _scheduler.start()
+
+
+def refresh_status():
+    with _lock:
+        return {prop: dict(status) for prop, status in _refreshes.items()}
+
+
+def _refresh_gauges():
+    status = refresh_status()
+    if not status:
+        return None
+
+    values = {}
+    for prop, refresh in status.items():
+        values[f"{prop}_refreshed_at"] = refresh["refreshed_at"]
+        values[f"{prop}_duration_seconds"] = refresh["duration"]
+        values[f"{prop}_failed"] = int(refresh["error"] is not None)
+    return values
+
+
+gauge_sources["dataset_refresh"] = _refresh_gauges
+
+
+def _load_snapshots(property_types):
+    results = {}
+    for prop in property_types:
+        df = load_snapshot(prop, SNAPSHOT_DIR)
+        if df is None:
+            continue
+        if "id" not in df.columns:
+            # Written before offers were keyed by id, reload from the database
+            continue
+
+        _store(prop, df, compute_watermark(df), snapshot=False)
+        results[prop] = df
+        threading.Thread(target=_refresh_in_background, args=(prop,),
+                         daemon=True).start()
+
+    return results
+
+
+def _publish(futures, property_type, df=None, error=None):
+    # Hands a table to the sessions waiting for it without waiting for the
+    # other tables loaded alongside
+    with _lock:
+        _inflight.pop(property_type, None)
+    if error is None:
+        futures[property_type].set_result(df)
+    else:
+        futures[property_type].set_exception(error)
+
+
+def _publish_failure(futures, property_type, error, entry):
+    # A table that was loaded before keeps being served when reloading it
+    # fails (e.g. the database is down); only a table never loaded reports
+    # the error to the page
+    if entry is None:
+        _publish(futures, property_type, error=error)
+        return
+
+    logger.error("Reloading %s failed, serving the previous version until "
+                 "the next retry", property_type, exc_info=error)
+    with _lock:
+        entry["retry_at"] = time.monotonic() + RETRY_INTERVAL
+    _publish(futures, property_type, entry["df"])
+
+
+async def _load(futures):
+    with _lock:
+        stale = {prop: _entries.get(prop) for prop in futures}
+
+    if SNAPSHOT_DIR:
+        snapshots = _load_snapshots(
+            [prop for prop, entry in stale.items() if entry is None])
+        for prop, df in snapshots.items():
+            _publish(futures, prop, df)
+
+    pending = [prop for prop, future in futures.items() if not future.done()]
+    full = [prop for prop in pending
+            if stale[prop] is None or not INCREMENTAL_SYNC]
+
+    async def load_full():
+        async for prop, df in load_data_async(full):
+            if isinstance(df, Exception):
+                _publish_failure(futures, prop, df, stale[prop])
+                continue
+            try:
+                await asyncio.to_thread(_store, prop, df, compute_watermark(df))
+            except Exception as e:
+                _publish_failure(futures, prop, e, stale[prop])
+            else:
+                _publish(futures, prop, df)
+
+    async def sync(prop):
+        try:
+            df = await asyncio.to_thread(_sync, prop, stale[prop])
+        except Exception as e:
+            _publish_failure(futures, prop, e, stale[prop])
+        else:
+            _publish(futures, prop, df)
+
+    await asyncio.gather(load_full(),
+                         *[sync(prop) for prop in pending if prop not in full])
+
+
+def get_datasets(property_types=PROPERTY_TYPES, ttl=None):
+    ttl = DATASET_TTL if ttl is None else ttl
+    start_refresh_scheduler()
+
+    to_load = {}
+    futures = {}
+    with _lock:
+        for prop in property_types:
+            entry = _entries.get(prop)
+            if _is_fresh(entry, ttl) or (entry is not None and _scheduler is not None):
+                future = Future()
+                future.set_result(entry["df"])
+            elif prop in _inflight:
+                future = _inflight[prop]
+            else:
+                future = _inflight[prop] = to_load[prop] = Future()
+            futures[prop] = future
+
+    if to_load:
+        try:
+            asyncio.run(_load(to_load))
+        except BaseException as e:
+            for prop, future in to_load.items():
+                if not future.done():
+                    _publish(to_load, prop, error=e)
+            raise
+
+    return {prop: future.result().copy(deep=False)
+            for prop, future in futures.items()}
+
+
+def get_dataset(property_type, ttl=None):
+    return get_datasets([property_type], ttl)[property_type]
+
+
+def sync_dataset(property_type):
+    with _lock:
+        entry = _entries.get(property_type)
+    if entry is None:
+        return get_dataset(property_type)
+    return _sync(property_type, entry).copy(deep=False)
+
+
+def _get_entry(property_type):
+    # The frame and its derived structures, taken from the same version
+    get_dataset(property_type)
+    with _lock:
+        return _entries[property_type]
+
+
+def get_derived(property_type, name):
+    return _get_entry(property_type)["derived"][name]
+
+
+def dataset_version(property_type):
+    with _lock:
+        entry = _entries.get(property_type)
+    return entry["version"] if entry is not None else None
+
+
+def invalidate(property_type=None):
+    with _lock:
+        if property_type is None:
+            _entries.clear()
+            _bounds.clear()
+            _urls.clear()
+        else:
+            _entries.pop(property_type, None)
+            _bounds.pop(property_type, None)
+            _urls.pop(property_type, None)
+    filtered_results.invalidate(property_type)
+    figures.invalidate(property_type)
+
+
+def get_filter_bounds(property_type):
+    if not QUERY_MODE:
+        return get_derived(property_type, "bounds")
+
+    with _lock:
+        cached = _bounds.get(property_type)
+    if cached is not None and time.monotonic() - cached[1] < DATASET_TTL:
+        return cached[0]
+
+    bounds = fetch_filter_bounds(property_type)
+    with _lock:
+        _bounds[property_type] = (bounds, time.monotonic())
+    return bounds
+
+
+def get_filtered(property_type, filters):
+    # In query mode the filters are pushed down to Postgres and only matching
+    # rows are transferred; otherwise the shared full frame is filtered
+    if QUERY_MODE:
+        return fetch_filtered_and_preprocess(property_type, filters)
+
+    entry = _get_entry(property_type)
+    key = fingerprint(property_type, entry["version"], filters)
+    df = filtered_results.get(key)
+    if df is None:
+        with span(f"filter:{property_type}"):
+            df = apply_filters(entry["df"], filters,
+                               index=entry["derived"]["bitmap_index"],
+                               stats=entry["derived"]["column_stats"])
+        df.attrs = {"property_type": property_type, "fingerprint": key}
+        filtered_results.put(key, df, int(df.memory_usage().sum()),
+                             tag=property_type)
+    return df.copy(deep=False)
+
+
+def with_urls(property_type, df):
+    # URLs are only needed for map popups, so they are fetched for the rows
+    # of the map and kept for later reruns instead of loaded for every offer
+    with _lock:
+        known = _urls.get(property_type)
+
+    ids = pd.Index(df["id"].unique())
+    missing = ids if known is None else ids.difference(known.index)
+    if len(missing):
+        fetched = fetch_urls(property_type, missing)
+        with _lock:
+            known = _urls.get(property_type)
+            if known is not None:
+                fetched = fetched[~fetched.index.isin(known.index)]
+                fetched = pd.concat([known, fetched])
+            known = _urls[property_type] = fetched
+
+    return df.assign(url=df["id"].map(known))
+
+
+def get_cube_cells(property_type, filters, bounds):
+    # None means the charts have to be computed by scanning the filtered rows
+    if QUERY_MODE or not cube_answerable(filters, bounds):
+        return None
+    return filter_cells(get_derived(property_type, "cube"), filters)
+
+
+def get_sketch_cells(property_type, filters, bounds):
+    # Quantile sketches of the cells matching the filters, under the same
+    # conditions as get_cube_cells
+    if QUERY_MODE or not cube_answerable(filters, bounds):
+        return None
+    return filter_sketches(get_derived(property_type, "sketches"), filters)
+
+
+def _cached_render(name, df, build, serialize):
+    # Keyed by the fingerprint get_filtered attached to the frame, which
+    # covers the dataset version and the filter values
+    def render():
+        with span(f"build:{name}"):
+            fig = build()
+        with span(f"serialize:{name}"):
+            return serialize(fig)
+
+    if "fingerprint" not in df.attrs:
+        return render()
+
+    key = fingerprint(df.attrs["fingerprint"], name)
+    rendered = figures.get(key)
+    if rendered is None:
+        rendered = render()
+        figures.put(key, rendered, len(rendered),
+                    tag=df.attrs["property_type"])
+    return rendered
+
+
+def cached_figure(name, df, build):
+    return json.loads(_cached_render(name, df, build, lambda fig: fig.to_json()))
+
+
+def cached_html(name, df, build):
+    return _cached_render(name, df, build, lambda fig: fig._repr_html_())
@@ -0,0 +1,241 @@
+import decimal
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from functions import lands, houses, apartments
+from functions.bitmap_index import bitmap_mask
+
+
+no_data_label = "<no data>"
+
+range_columns = {"lands": ["price", "land_area"],
+                 "houses": ["price", "house_area", "build_year"],
+                 "apartments": ["price", "apartment_area", "build_year"]}
+
+# Range bounds are handed to st.number_input, which needs plain Python numbers
+# of one kind per widget
+integer_columns = ["build_year"]
+
+category_columns = {"lands": ["province", "location"],
+                    "houses": ["province", "market", "location"],
+                    "apartments": ["province", "market", "status"]}
+
+# Mapping from the raw values stored in the otodom tables to the labels
+# produced by the preprocess functions, needed to push filters down to SQL
+category_labels = {"lands": {"location": lands.location_labels},
+                   "houses": {"market": houses.market_labels,
+                              "location": houses.location_labels},
+                   "apartments": {"market": apartments.market_labels,
+                                  "status": apartments.status_labels}}
+
+# Columns in which the preprocess functions replace missing values with a label
+no_data_columns = {"lands": ["location"], "houses": ["location"],
+                   "apartments": ["status"]}
+
+# Rows dropped by the preprocess functions, excluded on the SQL side as well
+base_conditions = {"lands": [],
+                   "houses": ["build_year IS NOT NULL"],
+                   "apartments": ["build_year IS NOT NULL"]}
+
+index_recommendations = {
+    "lands": [
+        "CREATE INDEX IF NOT EXISTS otodom_lands_created_idx "
+        "ON otodom_lands (utc_created_at)",
+        "CREATE INDEX IF NOT EXISTS otodom_lands_province_created_idx "
+        "ON otodom_lands (province, utc_created_at)"],
+    "houses": [
+        "CREATE INDEX IF NOT EXISTS otodom_houses_created_idx "
+        "ON otodom_houses (utc_created_at) WHERE build_year IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS otodom_houses_province_created_idx "
+        "ON otodom_houses (province, utc_created_at)"],
+    "apartments": [
+        "CREATE INDEX IF NOT EXISTS otodom_apartments_created_idx "
+        "ON otodom_apartments (utc_created_at) WHERE build_year IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS otodom_apartments_province_created_idx "
+        "ON otodom_apartments (province, utc_created_at)"]}
+
+
+def _to_python(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value.item() if hasattr(value, "item") else value
+
+
+def _bound(col, value):
+    return int(value) if col in integer_columns else float(value)
+
+
+def day_bounds(series, start, end):
+    # Filters are set with day precision, both ends inclusive
+    start, end = pd.Timestamp(start), pd.Timestamp(end + timedelta(days=1))
+    if series.dt.tz is not None:
+        start, end = start.tz_localize(series.dt.tz), end.tz_localize(series.dt.tz)
+    return start, end
+
+
+def frame_bounds(property_type, df):
+    bounds = {col: (_bound(col, df[col].min()), _bound(col, df[col].max()))
+              for col in range_columns[property_type]}
+    bounds.update({col: list(df[col].unique())
+                   for col in category_columns[property_type]})
+    return bounds
+
+
+def time_range(df, start, end):
+    # Preprocessed frames are sorted by utc_created_at, so a date range is a
+    # contiguous block of rows located with two binary searches
+    start, end = day_bounds(df["utc_created_at"], start, end)
+    lo, hi = np.searchsorted(df["utc_created_at"].values,
+                             [start.to_datetime64(), end.to_datetime64()])
+    # A start after the end selects nothing
+    return int(lo), int(max(lo, hi))
+
+
+def build_column_stats(property_type, df, n_quantiles=100):
+    # Quantiles of numeric columns and value frequencies of categorical ones,
+    # used to estimate how many rows a predicate keeps
+    stats = {}
+    for col, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            frequencies = df[col].value_counts(normalize=True, dropna=False)
+            stats[col] = {None if pd.isna(value) else value: share
+                          for value, share in frequencies.items()}
+        elif pd.api.types.is_numeric_dtype(dtype) and len(df):
+            values = df[col].to_numpy(dtype=float)
+            values = values[~np.isnan(values)]
+            if len(values):
+                stats[col] = {
+                    "quantiles": np.quantile(values, np.linspace(0, 1, n_quantiles + 1)),
+                    "non_null": len(values) / len(df)}
+    return stats
+
+
+def _selectivity(col, value, stats):
+    if col not in stats:
+        return 1.0
+
+    if isinstance(value, tuple):
+        quantiles = stats[col]["quantiles"]
+        if (value[0] <= quantiles[0] and value[1] >= quantiles[-1]
+                and stats[col]["non_null"] == 1):
+            return None
+        cdf = np.linspace(0, 1, len(quantiles))
+        share = np.interp(value[1], quantiles, cdf) - np.interp(value[0], quantiles, cdf)
+        return max(share, 0.0) * stats[col]["non_null"]
+
+    selected = {None if pd.isna(v) else v for v in value}
+    if selected.issuperset(stats[col]):
+        return None
+    return sum(stats[col].get(v, 0.0) for v in selected)
+
+
+def plan_filters(filters, stats=None):
+    # Predicates ordered from the most to the least selective; predicates that
+    # cannot exclude any row are dropped
+    plan = []
+    for col, value in filters.items():
+        if value is None or col == "utc_created_at":
+            continue
+
+        selectivity = _selectivity(col, value, stats or {})
+        if selectivity is not None:
+            plan.append((selectivity, col, value))
+
+    return sorted(plan, key=lambda predicate: predicate[0])
+
+
+def apply_filters(df, filters, index=None, stats=None):
+    # The date range is resolved first as a slice, then the remaining
+    # predicates run in plan order, each one only on the rows that passed the
+    # previous ones. index is the bitmap index of df (see bitmap_index.py) and
+    # stats its column statistics (see build_column_stats).
+    lo, hi = 0, len(df)
+    if filters.get("utc_created_at") is not None:
+        lo, hi = time_range(df, *filters["utc_created_at"])
+    data = df.iloc[lo:hi]
+
+    positions = None
+    for _, col, value in plan_filters(filters, stats):
+        if isinstance(value, tuple):
+            values = data[col].to_numpy()
+            if positions is not None:
+                values = values[positions]
+            # Compared in float64 like in Postgres (see build_where_clause);
+            # NumPy would cast the bounds to float32 for float32 columns
+            values = values.astype("float64", copy=False)
+            keep = (values >= value[0]) & (values <= value[1])
+        elif index is not None and col in index:
+            keep = bitmap_mask(index, {col: value}, lo, hi)
+            if keep is None:
+                continue
+            if positions is not None:
+                keep = keep[positions]
+        else:
+            column = data[col] if positions is None else data[col].iloc[positions]
+            keep = column.isin(value).to_numpy()
+
+        positions = np.flatnonzero(keep) if positions is None else positions[keep]
+        if not len(positions):
+            break
+
+    return data if positions is None else data.iloc[positions]
+
+
+def _raw_values(labels, selected):
+    raw = [key for key, label in labels.items() if label in selected]
+    raw += [value for value in selected
+            if value not in labels.values() and value != no_data_label]
+    return raw
+
+
+def build_where_clause(property_type, filters):
+    conditions = list(base_conditions[property_type])
+    params = {}
+    labels = category_labels[property_type]
+
+    for col, value in filters.items():
+        if value is None:
+            continue
+
+        if col == "utc_created_at":
+            conditions.append(f"{col} >= %({col}_from)s AND {col} < %({col}_to)s")
+            params[f"{col}_from"] = value[0]
+            params[f"{col}_to"] = value[1] + timedelta(days=1)
+        elif isinstance(value, tuple):
+            conditions.append(f"{col} BETWEEN %({col}_min)s AND %({col}_max)s")
+            params[f"{col}_min"] = _to_python(value[0])
+            params[f"{col}_max"] = _to_python(value[1])
+        else:
+            raw = _raw_values(labels.get(col, {}), value)
+            alternatives = []
+            if raw:
+                alternatives.append(f"{col} IN %({col})s")
+                params[col] = tuple(raw)
+            if no_data_label in value:
+                alternatives.append(f"{col} IS NULL")
+            conditions.append(
+                f"({' OR '.join(alternatives)})" if alternatives else "FALSE")
+
+    return " AND ".join(conditions) or "TRUE", params
+
+
+def build_bounds_query(property_type, table):
+    aggregates = [f"min({col}), max({col})" for col in range_columns[property_type]]
+    where = " AND ".join(base_conditions[property_type]) or "TRUE"
+    return f"SELECT {', '.join(aggregates)} FROM {table} WHERE {where}"
+
+
+def bounds_from_row(property_type, row, categories):
+    columns = range_columns[property_type]
+    bounds = {col: (_bound(col, row[2 * i]), _bound(col, row[2 * i + 1]))
+              for i, col in enumerate(columns)}
+
+    for col, values in categories.items():
+        labels = category_labels[property_type].get(col, {})
+        if col in no_data_columns[property_type]:
+            values = [no_data_label if value is None else value for value in values]
+        bounds[col] = list(dict.fromkeys(
+            labels.get(value, value) for value in values if value is not None))
+    return bounds
@@ -1,7 +1,5 @@
-import folium
-from branca.colormap import linear
-import plotly.subplots as sp
-import plotly.graph_objects as go
+
+from functions.schema import relabel
 
 
 color_1 = 'rgba(100, 149, 237, 0.6)'
@@ -11,38 +9,53 @@ color_4 = 'rgba(148, 137, 235, 0.6)'
 
 titles = ["Land area [m2]", "Price [PLN]", "Price per m2 [PLN/m2]"]
 
+location_labels = {"suburban": "Suburbs", "country": "Country", "city": "City"}
+
+schema = {"price": "float32", "land_area": "float32", "province": "category",
+          "location": "category", "latitude": "float32", "longitude": "float32"}
+
 
-def preprocess_lots(df):
+def preprocess_lots(df, compact=True):
     columns = ["price", "land_area", "utc_created_at", "province", "location",
-               "latitude", "longitude", "url"]
+               "latitude", "longitude", "id"]
 
     df = df[columns]
+    if compact:
+        df = df.astype(schema)
     df["price_per_m2"] = df["price"] / df["land_area"]
 
-    df["location"] = df["location"].fillna("<no data>")
-    df["location"] = df["location"].replace(
-        {"suburban": "Suburbs", "country": "Country", "city": "City"})
+    df["location"] = relabel(df["location"], location_labels,
+                             fill_value="<no data>")
+
+    # Kept in time order so date ranges resolve to slices, see filters.time_range
+    df = df.sort_values("utc_created_at", kind="stable", ignore_index=True)
 
     return df
 
 
-def plot_all(df):
+def plot_all(df, binned=True):
+    import plotly.subplots as sp
+    from functions.plotting import histogram
+
     fig = sp.make_subplots(rows=1, cols=3, subplot_titles=titles)
 
-    histogram1 = go.Histogram(x=df["land_area"],
-                              xbins=dict(start=1, end=2500, size=100),
-                              marker=dict(color=color_1,
-                                          line=dict(width=2, color="black")))
+    histogram1 = histogram(df["land_area"],
+                           xbins=dict(start=1, end=2500, size=100),
+                           marker=dict(color=color_1,
+                                       line=dict(width=2, color="black")),
+                           binned=binned)
 
-    histogram2 = go.Histogram(x=df["price"],
-                              xbins=dict(start=1e4, end=25e4, size=1e4),
-                              marker=dict(color=color_2,
-                                          line=dict(width=2, color="black")))
+    histogram2 = histogram(df["price"],
+                           xbins=dict(start=1e4, end=25e4, size=1e4),
+                           marker=dict(color=color_2,
+                                       line=dict(width=2, color="black")),
+                           binned=binned)
 
-    histogram3 = go.Histogram(x=df["price_per_m2"],
-                              xbins=dict(start=0, end=350, size=10),
-                              marker=dict(color=color_3,
-                                          line=dict(width=2, color="black")))
+    histogram3 = histogram(df["price_per_m2"],
+                           xbins=dict(start=0, end=350, size=10),
+                           marker=dict(color=color_3,
+                                       line=dict(width=2, color="black")),
+                           binned=binned)
 
     fig.add_trace(histogram1, row=1, col=1)
     fig.add_trace(histogram2, row=1, col=2)
@@ -63,26 +76,37 @@ def plot_all(df):
     return fig
 
 
-def plot_by_month(df):
-    data = df["utc_created_at"]
-    unique_months = data.groupby(data.dt.to_period("M")).min().dt.date.values
+def plot_by_month(df, month_data=None, quantile_data=None):
+    import plotly.subplots as sp
+    import plotly.graph_objects as go
+    from functions.plotting import quantile_bands
+    from functions.sketches import exact_month_quantiles
+
+    if month_data is not None:
+        unique_months, n_offers, price_data, price_per_m2_data = month_data
+    else:
+        data = df["utc_created_at"]
+        unique_months = data.groupby(data.dt.to_period("M")).min().dt.date.values
 
-    n_offers = []
-    price_data = []
-    price_per_m2_data = []
+        n_offers = []
+        price_data = []
+        price_per_m2_data = []
 
-    for unq_month in unique_months:
-        year = unq_month.year
-        month = unq_month.month
-        sub_df = df[(df["utc_created_at"].dt.year == year) & (
-                df["utc_created_at"].dt.month == month)]
+        for unq_month in unique_months:
+            year = unq_month.year
+            month = unq_month.month
+            sub_df = df[(df["utc_created_at"].dt.year == year) & (
+                    df["utc_created_at"].dt.month == month)]
 
-        n_offers.append(len(sub_df))
-        price_data.append(round(sub_df["price"].mean()))
-        price_per_m2_data.append(round(sub_df["price_per_m2"].mean()))
+            n_offers.append(len(sub_df))
+            price_data.append(round(sub_df["price"].mean()))
+            price_per_m2_data.append(round(sub_df["price_per_m2"].mean()))
 
-    titles = ["Number of offers", "Average price [PLN]",
-              "Average price per m2 [PLN/m2]"]
+    if quantile_data is None:
+        quantile_data = exact_month_quantiles(df)
+
+    titles = ["Number of offers", "Price [PLN]<br><sup>mean, median, IQR, p10-p90</sup>",
+              "Price per m2 [PLN/m2]<br><sup>mean, median, IQR, p10-p90</sup>"]
     fig = sp.make_subplots(rows=1, cols=3, subplot_titles=titles)
 
     line_chart1 = go.Scatter(x=unique_months, y=n_offers, mode='lines',
@@ -92,6 +116,10 @@ def plot_by_month(df):
     line_chart3 = go.Scatter(x=unique_months, y=price_per_m2_data, mode='lines',
                              line=dict(color=color_4, width=5))
 
+    for col, measure, color in [(2, "price", color_2), (3, "price_per_m2", color_4)]:
+        for trace in quantile_bands(quantile_data[measure], color):
+            fig.add_trace(trace, row=1, col=col)
+
     fig.add_trace(line_chart1, row=1, col=1)
     fig.add_trace(line_chart2, row=1, col=2)
     fig.add_trace(line_chart3, row=1, col=3)
@@ -106,15 +134,24 @@ def plot_by_month(df):
     return fig
 
 
-def plot_by_province(df):
-    grouped_data = df.groupby("province").mean(numeric_only=True).round()
+def plot_by_province(df, grouped_data=None, quantile_data=None):
+    import plotly.subplots as sp
+    import plotly.graph_objects as go
+    from functions.plotting import quantile_markers
+    from functions.sketches import exact_province_quantiles
+
+    if grouped_data is None:
+        grouped_data = df.groupby("province", observed=True).mean(
+            numeric_only=True).round()
+    if quantile_data is None:
+        quantile_data = exact_province_quantiles(df)
 
     area_data = grouped_data["land_area"].sort_values()
     price_data = grouped_data["price"].sort_values()
     price_per_m2_data = grouped_data["price_per_m2"].sort_values()
 
-    titles = ["Average area [m2]", "Average price [PLN]",
-              "Average price per m2 [PLN/m2]"]
+    titles = ["Average area [m2]", "Price [PLN]<br><sup>bars: mean, markers: median, IQR, p10-p90</sup>",
+              "Price per m2 [PLN/m2]<br><sup>bars: mean, markers: median, IQR, p10-p90</sup>"]
     fig = sp.make_subplots(rows=1, cols=3, shared_yaxes=False,
                            subplot_titles=titles, horizontal_spacing=0.1)
 
@@ -126,6 +163,10 @@ def plot_by_province(df):
     fig.add_trace(barplot2, row=1, col=2)
     fig.add_trace(barplot3, row=1, col=3)
 
+    for col, measure in [(2, "price"), (3, "price_per_m2")]:
+        for trace in quantile_markers(quantile_data[measure]):
+            fig.add_trace(trace, row=1, col=col)
+
     for i in fig['layout']['annotations']:
         i['font'] = dict(size=24)
 
@@ -137,21 +178,6 @@ def plot_by_province(df):
 
 
 def plot_map(df, urls=True):
-    colormap = linear.Blues_09.scale(min(df['price']), max(df['price']))
-    my_map = folium.Map(location=[52, 20], zoom_start=6)
-
-    df.iloc[::1].apply(lambda row: folium.CircleMarker(
-        location=(row['latitude'], row['longitude']), popup=(row["url"] if urls else None),
-        fill=colormap(row["price"]), fill_opacity=1,
-        radius=2, color=colormap(row["price"])
-        ).add_to(my_map), axis=1)
-
-    price_min = df["price"].min()
-    price_range = df["price"].max() - price_min
-    colormap = linear.Blues_09.to_step(
-        index=[price_min + i*price_range/4 for i in range(5)])
-    colormap.caption = 'Price [PLN]'
-    svg_style = '<style>svg#legend {font-size: 18px; margin-top: 8px}</style>'
-    my_map.get_root().header.add_child(folium.Element(svg_style))
-    colormap.add_to(my_map)
-    return my_map
+    from functions.maps import offers_map
+
+    return offers_map(df, urls=urls)
@@ -0,0 +1,175 @@
+import json
+import numpy as np
+import folium
+from branca.colormap import linear
+from branca.element import MacroElement
+from jinja2 import Template
+
+
+# (cell size in degrees, last zoom level at which the grid is drawn); offers
+# are drawn individually from point_zoom on
+grid_levels = [(0.4, 7), (0.2, 8), (0.1, 9), (0.05, 10)]
+point_zoom = 11
+
+
+def _to_js(values):
+    return json.dumps(values).replace("</", "<\\/")
+
+
+def build_grid_pyramid(df, levels=grid_levels):
+    data = df[["latitude", "longitude", "price", "price_per_m2"]]
+    data = data[data["latitude"].notna() & data["longitude"].notna()]
+
+    pyramid = []
+    for size, max_zoom in levels:
+        cells = data.assign(row=np.floor(data["latitude"] / size).astype(np.int64),
+                            col=np.floor(data["longitude"] / size).astype(np.int64))
+        stats = cells.groupby(["row", "col"]).agg(
+            count=("price", "size"),
+            price_mean=("price", "mean"),
+            price_median=("price", "median"),
+            price_per_m2_mean=("price_per_m2", "mean"),
+            price_per_m2_median=("price_per_m2", "median")).reset_index()
+        pyramid.append((size, max_zoom, stats))
+
+    return pyramid
+
+
+class OffersLayer(MacroElement):
+    # Below point_zoom the map shows grid cells of the pyramid level matching
+    # the zoom; from point_zoom on it draws only the offers inside the current
+    # view. Everything is drawn on one canvas renderer from flat arrays, and
+    # popups are built when a point or cell is clicked.
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var renderer = L.canvas({padding: 0.5});
+            var palette = {{ this.palette }};
+            var points = {{ this.points }};
+            var urls = {{ this.urls }};
+            var levels = {{ this.levels }};
+            var pointZoom = {{ this.point_zoom }};
+
+            function cellLayer(level) {
+                var layer = L.featureGroup();
+                for (var i = 0; i < level.row.length; i++) {
+                    var south = level.row[i] * level.size, west = level.col[i] * level.size;
+                    var c = palette[level.color[i]];
+                    layer.addLayer(L.rectangle(
+                        [[south, west], [south + level.size, west + level.size]],
+                        {renderer: renderer, index: i, weight: 0.5, color: c,
+                         fillColor: c, fillOpacity: 0.8}));
+                }
+                layer.on("click", function(e) {
+                    var i = e.layer.options.index;
+                    L.popup().setLatLng(e.latlng).setContent(
+                        "Offers: " + level.count[i] +
+                        "<br>Price [PLN]: mean " + level.price_mean[i] +
+                        ", median " + level.price_median[i] +
+                        "<br>Price per m2 [PLN/m2]: mean " + level.price_per_m2_mean[i] +
+                        ", median " + level.price_per_m2_median[i]).openOn(map);
+                });
+                return layer;
+            }
+
+            var pointLayer = L.featureGroup();
+            if (urls !== null) {
+                pointLayer.on("click", function(e) {
+                    var content = document.createTextNode(urls[e.layer.options.index]);
+                    L.popup().setLatLng(e.latlng).setContent(content).openOn(map);
+                });
+            }
+
+            function drawPoints() {
+                var bounds = map.getBounds().pad(0.2);
+                pointLayer.clearLayers();
+                for (var i = 0; i < points.lat.length; i++) {
+                    if (!bounds.contains([points.lat[i], points.lon[i]])) continue;
+                    var c = palette[points.color[i]];
+                    pointLayer.addLayer(L.circleMarker([points.lat[i], points.lon[i]], {
+                        renderer: renderer, index: i, radius: 2, weight: 1,
+                        color: c, fillColor: c, fillOpacity: 1}));
+                }
+            }
+
+            var cellLayers = {};
+            var current = null;
+            function render() {
+                var zoom = map.getZoom(), next;
+                if (zoom >= pointZoom) {
+                    drawPoints();
+                    next = pointLayer;
+                } else {
+                    var k = 0;
+                    while (k < levels.length - 1 && zoom > levels[k].max_zoom) k++;
+                    if (!(k in cellLayers)) cellLayers[k] = cellLayer(levels[k]);
+                    next = cellLayers[k];
+                }
+                if (next === current) return;
+                if (current !== null) map.removeLayer(current);
+                current = next.addTo(map);
+            }
+
+            map.on("moveend", render);
+            render();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, df, colormap, urls=True, pyramid=None, n_colors=256):
+        super().__init__()
+        self._name = "OffersLayer"
+        self.point_zoom = point_zoom
+
+        price_min, price_max = colormap.vmin, colormap.vmax
+        scale = (n_colors - 1) / (price_max - price_min) if price_max > price_min else 0
+
+        def color_index(price):
+            price = np.nan_to_num(np.asarray(price, dtype=float), nan=price_min)
+            return np.clip(np.round((price - price_min) * scale), 0,
+                           n_colors - 1).astype(int).tolist()
+
+        self.palette = _to_js([colormap(value) for value in
+                               np.linspace(price_min, price_max, n_colors)])
+
+        data = df[df["latitude"].notna() & df["longitude"].notna()
+                  & df["price"].notna()]
+        self.points = _to_js({
+            "lat": np.round(data["latitude"].to_numpy(dtype=float), 5).tolist(),
+            "lon": np.round(data["longitude"].to_numpy(dtype=float), 5).tolist(),
+            "color": color_index(data["price"])})
+        self.urls = _to_js(data["url"].tolist() if urls else None)
+
+        if pyramid is None:
+            pyramid = build_grid_pyramid(df)
+
+        levels = []
+        for size, max_zoom, stats in pyramid:
+            level = {"size": size, "max_zoom": max_zoom,
+                     "row": stats["row"].tolist(), "col": stats["col"].tolist(),
+                     "count": stats["count"].tolist(),
+                     "color": color_index(stats["price_median"])}
+            for col in ["price_mean", "price_median", "price_per_m2_mean",
+                        "price_per_m2_median"]:
+                values = stats[col].replace([np.inf, -np.inf], np.nan).round()
+                level[col] = values.astype("Int64").fillna(0).tolist()
+            levels.append(level)
+        self.levels = _to_js(levels)
+
+
+def offers_map(df, urls=True, pyramid=None):
+    colormap = linear.Blues_09.scale(df["price"].min(), df["price"].max())
+    my_map = folium.Map(location=[52, 20], zoom_start=6, prefer_canvas=True)
+
+    OffersLayer(df, colormap, urls=urls, pyramid=pyramid).add_to(my_map)
+
+    price_min = df["price"].min()
+    price_range = df["price"].max() - price_min
+    colormap = linear.Blues_09.to_step(
+        index=[price_min + i * price_range / 4 for i in range(5)])
+    colormap.caption = 'Price [PLN]'
+    svg_style = '<style>svg#legend {font-size: 18px; margin-top: 8px}</style>'
+    my_map.get_root().header.add_child(folium.Element(svg_style))
+    colormap.add_to(my_map)
+    return my_map
@@ -0,0 +1,60 @@
+import numpy as np
+import plotly.graph_objects as go
+
+
+def histogram(values, xbins, marker, binned=True):
+    # With binned=True the counts are computed here and only O(bins) values
+    # are sent to the browser instead of every raw value of the column
+    if not binned:
+        return go.Histogram(x=values, xbins=xbins, marker=marker)
+
+    start, end, size = xbins["start"], xbins["end"], xbins.get("size", 1)
+    n_bins = int(np.ceil((end - start) / size))
+
+    # Same convention as plotly: bins are closed on the left and the edges
+    # are stepped from start until they reach or exceed end
+    positions = np.floor((np.asarray(values, dtype=float) - start) / size)
+    positions = positions[(positions >= 0) & (positions < n_bins)]
+    counts = np.bincount(positions.astype(np.int64), minlength=n_bins)
+    centers = start + size * (np.arange(n_bins) + 0.5)
+
+    return go.Bar(x=centers, y=counts, width=size, marker=marker)
+
+
+def _with_opacity(color, opacity):
+    return color.rsplit(",", 1)[0] + f", {opacity})"
+
+
+def quantile_bands(values, color):
+    # p10-p90 and interquartile bands with a dashed median line; values has
+    # one row per x value and one column per quantile
+    values = values.round()
+    x = list(values.index)
+    traces = []
+    for low, high, opacity in [(0.1, 0.9, 0.15), (0.25, 0.75, 0.3)]:
+        traces.append(go.Scatter(x=x, y=values[low], mode='lines',
+                                 line=dict(width=0), hoverinfo='skip'))
+        traces.append(go.Scatter(x=x, y=values[high], mode='lines',
+                                 line=dict(width=0), fill='tonexty',
+                                 fillcolor=_with_opacity(color, opacity),
+                                 hoverinfo='skip'))
+    traces.append(go.Scatter(x=x, y=values[0.5], mode='lines', name="median",
+                             line=dict(color=_with_opacity(color, 1), width=3,
+                                       dash='dash')))
+    return traces
+
+
+def quantile_markers(values):
+    # Median markers with interquartile (thick) and p10-p90 (thin) whiskers,
+    # drawn over horizontal bars
+    values = values.round()
+    y = list(values.index)
+    median = values[0.5]
+    return [go.Scatter(x=median, y=y, mode='markers', name=name,
+                       marker=dict(color="black", size=size),
+                       error_x=dict(type='data', symmetric=False,
+                                    array=values[high] - median,
+                                    arrayminus=median - values[low],
+                                    thickness=thickness, width=0, color="black"))
+            for name, low, high, thickness, size in [
+                ("p10-p90", 0.1, 0.9, 1.5, 0), ("median, IQR", 0.25, 0.75, 5, 9)]]
@@ -0,0 +1,75 @@
+import json
+import hashlib
+import threading
+from datetime import date
+from collections import OrderedDict
+
+
+def _normalize(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(key): _normalize(v) for key, v in value.items()}
+    if isinstance(value, tuple):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (list, set)):
+        # Multiselect order does not change the result
+        return sorted((_normalize(v) for v in value), key=str)
+    return value
+
+
+def fingerprint(*parts):
+    canonical = json.dumps(_normalize(parts), sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+class LRUCache:
+    # Thread-safe, shared by all sessions of the process and bounded by the
+    # total size of the stored values; entries are tagged (e.g. with the
+    # property type) so they can be dropped when their dataset changes
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (value, size, tag)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size, tag=None):
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+
+            self._items[key] = (value, size, tag)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._bytes -= self._items.popitem(last=False)[1][1]
+
+    def invalidate(self, tag=None):
+        with self._lock:
+            for key in [key for key, item in self._items.items()
+                        if tag is None or item[2] == tag]:
+                self._bytes -= self._items.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._items), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes}
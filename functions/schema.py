@@ -0,0 +1,47 @@
+import pandas as pd
+
+
+def relabel(series, labels, fill_value=None):
+    # On categorical columns both the fill and the mapping only touch the
+    # categories, not every row
+    categorical = isinstance(series.dtype, pd.CategoricalDtype)
+
+    if fill_value is not None:
+        if categorical and fill_value not in series.cat.categories:
+            series = series.cat.add_categories([fill_value])
+        series = series.fillna(fill_value)
+
+    series = series.map(lambda value: labels.get(value, value), na_action="ignore")
+    return series.astype("category") if categorical else series
+
+
+def concat_compact(frames):
+    # pd.concat turns categoricals with different categories into objects,
+    # so the categories are unified first
+    frames = [df for df in frames if len(df)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+
+    for col, dtype in frames[0].dtypes.items():
+        if not isinstance(dtype, pd.CategoricalDtype):
+            continue
+
+        categories = frames[0][col].cat.categories
+        for df in frames[1:]:
+            categories = categories.union(df[col].cat.categories, sort=False)
+
+        frames = [df.assign(**{col: df[col].cat.set_categories(categories)})
+                  for df in frames]
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def memory_report(before, after):
+    report = pd.DataFrame({"dtype_before": before.dtypes.astype(str),
+                           "dtype_after": after.dtypes.astype(str),
+                           "bytes_before": before.memory_usage(index=False, deep=True),
+                           "bytes_after": after.memory_usage(index=False, deep=True)})
+    report.loc["total"] = ["", "", report["bytes_before"].sum(),
+                           report["bytes_after"].sum()]
+    report["ratio"] = report["bytes_after"] / report["bytes_before"]
+    return report
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from functions.cube import cube_dimensions, complete_rows, filter_cells
+
+
+# Log-bucketed sketches (as in DDSketch) of the price measures, kept per cube
+# cell. A value v > 0 falls in bucket ceil(log_gamma(v)), so a cell is just
+# the counts of its buckets and merging cells means adding counts. Every value
+# of a bucket is within RELATIVE_ACCURACY of the bucket's estimate, so a
+# quantile read from merged cells is within RELATIVE_ACCURACY (relative) of
+# the exact lower quantile (np.quantile(..., method="lower")) of the same
+# offers. Quantiles are returned unrounded, as rounding would add up to 0.5 to
+# the error of small values; the charts round them for display. Zero, negative
+# and missing values are not sketched, nor are the rows left out of the cube
+# (see cube.complete_rows).
+RELATIVE_ACCURACY = 0.01
+gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+sketch_measures = ["price", "price_per_m2"]
+
+quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def build_sketches(property_type, df):
+    dims = cube_dimensions[property_type]
+    df = complete_rows(property_type, df)
+    data = df.assign(day=df["utc_created_at"].dt.floor("D"))
+
+    sketches = {}
+    for measure in sketch_measures:
+        values = data[measure].to_numpy(dtype="float64")
+        valid = np.isfinite(values) & (values > 0)
+        buckets = np.ceil(np.log(values[valid]) / np.log(gamma)).astype("int16")
+
+        cells = data.loc[valid, dims].assign(bucket=buckets)
+        sketches[measure] = (cells.groupby(dims + ["bucket"], observed=True,
+                                           dropna=False)
+                             .size().rename("count").reset_index())
+    return sketches
+
+
+def filter_sketches(sketches, filters):
+    return {measure: filter_cells(cells, filters)
+            for measure, cells in sketches.items()}
+
+
+def _bucket_quantiles(cells, by):
+    # Merges the cells of every group and reads the quantiles from the
+    # cumulative bucket counts
+    merged = cells.groupby([by, "bucket"], observed=True)["count"].sum()
+    merged = merged[merged > 0]
+    cumulative = merged.groupby(level=0, observed=True).cumsum()
+    ranks = merged.groupby(level=0, observed=True).transform("sum") - 1
+
+    result = {}
+    for q in quantiles:
+        reached = cumulative[cumulative > q * ranks]
+        first = reached.groupby(level=0, observed=True).head(1).index
+        result[q] = pd.Series(
+            2 * gamma ** first.get_level_values(1).to_numpy(dtype="float64")
+            / (gamma + 1), index=first.get_level_values(0))
+    return pd.DataFrame(result)
+
+
+def month_quantiles(sketches):
+    # Indexed like the months of cube.month_stats, by the first day with
+    # offers in the month
+    result = {}
+    for measure, cells in sketches.items():
+        cells = cells.assign(month=cells["day"].dt.to_period("M"))
+        first_days = cells.groupby("month")["day"].min().dt.date
+        values = _bucket_quantiles(cells, "month")
+        result[measure] = values.set_axis(first_days[values.index].values)
+    return result
+
+
+def province_quantiles(sketches):
+    return {measure: _bucket_quantiles(cells, "province")
+            for measure, cells in sketches.items()}
+
+
+def _exact_quantiles(df, by):
+    return {measure: df.groupby(by, observed=True)[measure]
+            .quantile(quantiles, interpolation="lower").unstack()
+            for measure in sketch_measures}
+
+
+# Same layouts, computed from the rows when the sketches cannot answer the
+# filters
+def exact_month_quantiles(df):
+    months = df["utc_created_at"].dt.to_period("M")
+    first_days = df["utc_created_at"].groupby(months).min().dt.date
+    return {measure: values.set_axis(first_days[values.index].values)
+            for measure, values in _exact_quantiles(df, months).items()}
+
+
+def exact_province_quantiles(df):
+    return _exact_quantiles(df, "province")
@@ -0,0 +1,23 @@
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def _load_datasets():
+    # dataset_cache (pandas, SQLAlchemy and the loaders) is imported here so
+    # that importing this module stays cheap
+    try:
+        from functions.dataset_cache import get_datasets
+        get_datasets()
+    except Exception:
+        logger.exception("Loading the datasets in the background failed")
+
+
+def warm_up():
+    # Starts loading every table without waiting for it; pages asking for a
+    # table that is still loading wait for the same load, and fresh tables
+    # are returned from the cache right away
+    threading.Thread(target=_load_datasets, name="dataset-warm-up",
+                     daemon=True).start()
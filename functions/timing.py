@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PERFORMANCE_PANEL = os.environ.get("PERFORMANCE_PANEL", "0") == "1"
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+
+# Upper bounds (in seconds) of the histogram buckets, as in Prometheus
+buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+           60, float("inf")]
+
+# Name -> function returning a dict of current values (or None), exported
+# as gauges next to the histograms
+gauge_sources = {}
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> {"buckets": [count per bucket], "sum", "count"}
+
+# Spans of the rerun executed by the current thread; Streamlit runs every
+# rerun of a session in its own script thread
+_run = threading.local()
+
+
+def _observe(stage, seconds):
+    with _lock:
+        histogram = _histograms.setdefault(
+            stage, {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+                break
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+@contextmanager
+def span(stage):
+    # Appended when opened, so nested spans follow their parent
+    record = {"stage": stage, "seconds": None, "depth": getattr(_run, "depth", 0)}
+    if getattr(_run, "spans", None) is not None:
+        _run.spans.append(record)
+
+    _run.depth = record["depth"] + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _run.depth = record["depth"]
+        _observe(stage, record["seconds"])
+
+
+def start_run(page):
+    _run.page = page
+    _run.spans = []
+    _run.depth = 0
+    _run.started = time.perf_counter()
+
+
+def finish_run():
+    # Logs the spans of the rerun as one JSON record, refreshes the metrics
+    # file and returns the spans for the performance panel
+    spans = getattr(_run, "spans", None)
+    if spans is None:
+        return []
+
+    total = time.perf_counter() - _run.started
+    _observe(f"rerun:{_run.page}", total)
+    logger.debug(json.dumps({"event": "rerun", "page": _run.page,
+                             "seconds": total, "spans": spans}))
+    _run.spans = None
+
+    if METRICS_FILE:
+        try:
+            write_metrics(METRICS_FILE)
+        except OSError:
+            logger.exception("Could not write metrics to %s", METRICS_FILE)
+
+    return spans + [{"stage": "total", "seconds": total, "depth": 0}]
+
+
+def histograms():
+    with _lock:
+        return {stage: {"buckets": list(h["buckets"]), "sum": h["sum"],
+                        "count": h["count"]}
+                for stage, h in _histograms.items()}
+
+
+def prometheus_text():
+    name = "dashboard_stage_duration_seconds"
+    lines = [f"# HELP {name} Duration of loading, filtering and rendering stages",
+             f"# TYPE {name} histogram"]
+
+    for stage, histogram in sorted(histograms().items()):
+        cumulative = 0
+        for bound, count in zip(buckets, histogram["buckets"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+
+    for source, func in sorted(gauge_sources.items()):
+        values = func()
+        if values is None:
+            continue
+        lines.append(f"# TYPE dashboard_{source} gauge")
+        lines.extend(f'dashboard_{source}{{metric="{key}"}} {value}'
+                     for key, value in values.items())
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    # Written for the node_exporter textfile collector, which must never see
+    # a partially written file
+    text = prometheus_text()
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def performance_panel(spans):
+    if not PERFORMANCE_PANEL or not spans:
+        return
+
+    import streamlit as st
+
+    with st.sidebar.expander("Performance", expanded=True):
+        st.table([{"stage": " " * s["depth"] + s["stage"],
+                   "ms": round(s["seconds"] * 1000, 1)} for s in spans])
+        for source, func in sorted(gauge_sources.items()):
+            values = func()
+            if values is not None:
+                st.caption(source + ": " + ", ".join(
+                    f"{key} {value}" for key, value in values.items()))
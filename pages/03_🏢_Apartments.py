@@ -1,11 +1,17 @@
 import streamlit as st
 from datetime import date, timedelta
 
-from functions.data_loading import load_data_concurrently
+from functions.cube import month_stats, province_means
+from functions.sketches import month_quantiles, province_quantiles
+from functions.dataset_cache import (get_filter_bounds, get_filtered, get_cube_cells,
+                                     get_sketch_cells, cached_figure, cached_html,
+                                     with_urls)
 from functions.apartments import plot_all, plot_by_month, plot_by_province, plot_map
+from functions.timing import span, start_run, finish_run, performance_panel
 
 
 st.set_page_config(layout="wide", page_title="Apartments")
+start_run("apartments")
 
 st.title("Apartments")
 st.header("Filters")
@@ -19,13 +25,8 @@ st.markdown(
        </style>
    """, unsafe_allow_html=True)
 
-try:
-    df = st.session_state.data["apartments"]
-except (KeyError, AttributeError):
-    with st.spinner(f'Data loading'):
-        st.session_state.data = {}
-        load_data_concurrently(True)
-        df = st.session_state.data["apartments"]
+with st.spinner(f'Data loading'), span("get_filter_bounds"):
+    bounds = get_filter_bounds("apartments")
 
 min_area, max_area, _, min_price, max_price, _, min_created, max_created = (
     st.columns([3, 3, 1, 3, 3, 1, 3, 3]))
@@ -35,23 +36,26 @@ province, _, market, status, _, min_year, max_year = (
 
 with min_area:
     min_area_filter = min_area.number_input(
-        "Minimum apartment area", min_value=df['apartment_area'].min(),
-        value=df['apartment_area'].min(), max_value=df['apartment_area'].max())
+        "Minimum apartment area", min_value=bounds['apartment_area'][0],
+        value=bounds['apartment_area'][0], max_value=bounds['apartment_area'][1])
 
 with max_area:
     max_area_filter = max_area.number_input(
-        "Maximum apartment area", min_value=df['apartment_area'].min(),
-        value=df['apartment_area'].max(), max_value=df['apartment_area'].max())
+        "Maximum apartment area", min_value=bounds['apartment_area'][0],
+        value=bounds['apartment_area'][1], max_value=bounds['apartment_area'][1])
 
 with min_price:
     min_price_filter = min_price.number_input(
-        "Minimum price", min_value=df['price'].min(), value=df['price'].min(),
-        max_value=1200000)  # outliers in data
+        "Minimum price", min_value=bounds['price'][0], value=bounds['price'][0],
+        max_value=1200000.0)  # outliers in data
 
+# The price cap is below the largest price, so the default view is not one the
+# cube and the sketches can answer (see cube.cube_answerable) and its charts
+# are computed from the filtered rows
 with max_price:
     max_price_filter = max_price.number_input(
-        "Maximum price", min_value=df['price'].min(),
-        value=1200000, max_value=1200000)
+        "Maximum price", min_value=bounds['price'][0],
+        value=1200000.0, max_value=1200000.0)
 
 with min_created:
     min_created_filter = min_created.date_input(
@@ -65,42 +69,41 @@ with province:
     toggle_province = st.toggle('Filter provinces')
     if toggle_province:
         province_filter = province.multiselect(
-            "Provinces", options=df["province"].unique(),
-            default=df["province"].unique())
+            "Provinces", options=bounds["province"],
+            default=bounds["province"])
 
 with market:
     market_filter = market.multiselect(
-        "Market", options=df["market"].unique(), default=df["market"].unique())
+        "Market", options=bounds["market"], default=bounds["market"])
 
 with status:
     status_filter = status.multiselect(
-        "Status", options=df["status"].unique(),
-        default=df["status"].unique())
+        "Status", options=bounds["status"],
+        default=bounds["status"])
 
 with min_year:
     min_year_filter = min_year.number_input(
-        "Minimum year of construction", min_value=df['build_year'].min(),
-        value=df['build_year'].min(), max_value=df['build_year'].max())
+        "Minimum year of construction", min_value=bounds['build_year'][0],
+        value=bounds['build_year'][0], max_value=bounds['build_year'][1])
 
 with max_year:
     max_year_filter = max_year.number_input(
-        "Maximum year of construction", min_value=df['build_year'].min(),
-        value=df['build_year'].max(), max_value=df['build_year'].max())
+        "Maximum year of construction", min_value=bounds['build_year'][0],
+        value=bounds['build_year'][1], max_value=bounds['build_year'][1])
 
 
-df = df[(df["utc_created_at"].dt.date <= max_created_filter) &
-        (df["utc_created_at"].dt.date >= min_created_filter) &
-        (df["price"] >= min_price_filter) &
-        (df["price"] <= max_price_filter) &
-        (df["apartment_area"] <= max_area_filter) &
-        (df["apartment_area"] >= min_area_filter) &
-        (df["build_year"] <= max_year_filter) &
-        (df["build_year"] >= min_year_filter) &
-        (df["market"].isin(market_filter)) &
-        (df["status"].isin(status_filter))]
+filters = {"utc_created_at": (min_created_filter, max_created_filter),
+           "price": (min_price_filter, max_price_filter),
+           "apartment_area": (min_area_filter, max_area_filter),
+           "build_year": (min_year_filter, max_year_filter),
+           "market": market_filter,
+           "status": status_filter,
+           "province": province_filter if toggle_province else None}
 
-if "province_filter" in locals():
-    df = df[df["province"].isin(province_filter)]
+with st.spinner(f'Data loading'), span("get_filtered"):
+    df = get_filtered("apartments", filters)
+    cells = get_cube_cells("apartments", filters, bounds)
+    sketches = get_sketch_cells("apartments", filters, bounds)
 
 st.markdown(f"Number of offers: {len(df)}")
 
@@ -108,33 +111,42 @@ st.header("Charts")
 
 
 if len(df):
-    with st.spinner(f'Processing {len(df)} offers'):
-        fig_all = plot_all(df)
+    with st.spinner(f'Processing {len(df)} offers'), span("chart:plot_all"):
+        fig_all = cached_figure("plot_all", df, lambda: plot_all(df))
         st.plotly_chart(fig_all)
         st.markdown("***")
 
-    with st.spinner(f'Processing {len(df)} offers'):
-        fig_by_month = plot_by_month(df)
+    with st.spinner(f'Processing {len(df)} offers'), span("chart:plot_by_month"):
+        fig_by_month = cached_figure(
+            "plot_by_month", df, lambda: plot_by_month(
+                df, None if cells is None else month_stats(cells),
+                None if sketches is None else month_quantiles(sketches)))
         st.plotly_chart(fig_by_month)
         st.markdown("***")
 
 
-    with st.spinner(f'Processing {len(df)} offers'):
-        fig_by_province = plot_by_province(df)
+    with st.spinner(f'Processing {len(df)} offers'), span("chart:plot_by_province"):
+        fig_by_province = cached_figure(
+            "plot_by_province", df, lambda: plot_by_province(
+                df, None if cells is None else province_means(cells, "apartment_area"),
+                None if sketches is None else province_quantiles(sketches)))
         st.plotly_chart(fig_by_province)
         st.markdown("***")
 
-    with st.spinner(f'Processing {len(df)} offers'):
+    with st.spinner(f'Processing {len(df)} offers'), span("chart:plot_map"):
         button_map = st.button('Show map')
 
         toggle_urls = st.toggle(
             'Show offers URLs (may take longer)')
 
         if button_map:
-            fig_map = plot_map(df, urls=toggle_urls)
+            map_html = cached_html(f"plot_map_{toggle_urls}", df, lambda: plot_map(
+                with_urls("apartments", df) if toggle_urls else df, urls=toggle_urls))
             if toggle_urls:
                 st.markdown("Click on the point to see the URL")
 
-            st.components.v1.html(fig_map._repr_html_(), width=1100, height=1200)
+            st.components.v1.html(map_html, width=1100, height=1200)
 else:
     st.markdown("There are no offers that match your criteria")
+
+performance_panel(finish_run())